@@ -0,0 +1,181 @@
+"""Periodic checkpoints of a training run, from which training can be resumed.
+
+A checkpoint directory holds one subdirectory per checkpoint and a file
+`latest` naming the most recent complete one. Checkpoints are written to a
+temporary directory by a background thread and renamed into place when done,
+so a run that dies while writing leaves the previous checkpoint intact.
+"""
+import json
+import os
+import shutil
+import threading
+from os.path import exists, join
+
+import numpy as np
+
+from rungsted.corruption import get_random_state, set_random_state
+from rungsted.feat_map import CDictFeatMap
+
+LATEST = 'latest'
+
+
+class Checkpointer(object):
+    def __init__(self, directory, keep=2):
+        self.directory = directory
+        self.keep = keep
+        self.thread = None
+        self.error = None
+        self.last_n_updates = None
+
+        if not exists(directory):
+            os.makedirs(directory)
+
+    def save(self, transition, emission, feat_map, labels, progress):
+        """Snapshot the training state and write it in the background.
+
+        `progress` is a dict with the `epoch`, the `sentence` to continue from
+        in that epoch, and the number of updates `n_updates` made so far.
+        """
+        # Only one checkpoint is written at a time
+        self.wait()
+
+        # E.g. the end of a pass right after a periodic checkpoint. The state is the same.
+        if progress['n_updates'] == self.last_n_updates:
+            return
+        self.last_n_updates = progress['n_updates']
+
+        progress = dict(progress,
+                        random_state=list(get_random_state()),
+                        numpy_random_state=_numpy_random_state_to_json(np.random.get_state()))
+        snapshot = dict(transition=transition.get_state(),
+                        emission=emission.get_state(),
+                        labels=list(labels),
+                        progress=progress)
+
+        self.thread = threading.Thread(target=self._write, args=(snapshot, feat_map))
+        self.thread.start()
+
+    def wait(self):
+        """Wait for the checkpoint being written. Raises the error if writing failed."""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _write(self, snapshot, feat_map):
+        # Keep the error, so that it is raised in the training thread
+        try:
+            self._write_checkpoint(snapshot, feat_map)
+        except Exception as e:
+            self.error = e
+
+    def _write_checkpoint(self, snapshot, feat_map):
+        name = 'checkpoint-{}'.format(snapshot['progress']['n_updates'])
+        tmp_path = join(self.directory, name + '.tmp')
+        if exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        np.savez(join(tmp_path, 'transition.npz'), **snapshot['transition'])
+        np.savez(join(tmp_path, 'emission.npz'), **snapshot['emission'])
+        np.save(join(tmp_path, 'labels'), snapshot['labels'])
+        # The feature map is frozen during training, so it is safe to save from this thread
+        if isinstance(feat_map, CDictFeatMap):
+            feat_map.save(join(tmp_path, 'feature_map.npz'))
+        with open(join(tmp_path, 'progress.json'), 'w') as out:
+            json.dump(snapshot['progress'], out)
+
+        path = join(self.directory, name)
+        if name == _read_latest(self.directory):
+            # Never remove the checkpoint `latest` points to. It holds the same state,
+            # e.g. because training was resumed from it.
+            shutil.rmtree(tmp_path)
+        else:
+            if exists(path):
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+
+        # Point to the new checkpoint
+        latest_tmp = join(self.directory, LATEST + '.tmp')
+        with open(latest_tmp, 'w') as out:
+            print(name, file=out)
+        os.replace(latest_tmp, join(self.directory, LATEST))
+
+        self._remove_old()
+
+    def _remove_old(self):
+        latest = _read_latest(self.directory)
+        for name in _checkpoint_names(self.directory)[:-self.keep]:
+            if name != latest:
+                shutil.rmtree(join(self.directory, name))
+
+
+def _checkpoint_names(directory):
+    # Complete checkpoints, oldest first
+    checkpoints = sorted((int(name.split('-')[1]), name) for name in os.listdir(directory)
+                         if name.startswith('checkpoint-') and not name.endswith('.tmp'))
+    return [name for _, name in checkpoints]
+
+
+def _read_latest(directory):
+    try:
+        with open(join(directory, LATEST)) as latest_file:
+            return latest_file.read().strip()
+    except IOError:
+        return None
+
+
+def _is_complete(path):
+    # progress.json is written last
+    return exists(join(path, 'progress.json'))
+
+
+def load_checkpoint(directory):
+    """Load the latest checkpoint in `directory`.
+
+    Returns a dict with the `transition` and `emission` weight states, the
+    `labels`, the `progress` and, for dictionary feature maps, the `feat_map`.
+    """
+    latest = _read_latest(directory)
+    if latest and _is_complete(join(directory, latest)):
+        path = join(directory, latest)
+    else:
+        # Fall back to the newest complete checkpoint
+        complete = [name for name in _checkpoint_names(directory) if _is_complete(join(directory, name))]
+        if not complete:
+            raise ValueError("No complete checkpoint found in {}".format(directory))
+        path = join(directory, complete[-1])
+
+    checkpoint = {}
+    for name in ['transition', 'emission']:
+        with np.load(join(path, name + '.npz')) as npz_file:
+            checkpoint[name] = dict(npz_file.items())
+
+    checkpoint['labels'] = list(np.load(join(path, 'labels.npy')))
+    if exists(join(path, 'feature_map.npz')):
+        checkpoint['feat_map'] = CDictFeatMap.load(join(path, 'feature_map.npz'))
+
+    with open(join(path, 'progress.json')) as progress_file:
+        checkpoint['progress'] = json.load(progress_file)
+
+    return checkpoint
+
+
+def restore_random_state(progress):
+    """Restore the random number generators to their state at the checkpoint.
+    Call right before training continues."""
+    set_random_state(bytes(progress['random_state']))
+    np.random.set_state(_numpy_random_state_from_json(progress['numpy_random_state']))
+
+
+def _numpy_random_state_to_json(state):
+    name, keys, pos, has_gauss, cached_gaussian = state
+    return [name, keys.tolist(), pos, has_gauss, cached_gaussian]
+
+
+def _numpy_random_state_from_json(state):
+    name, keys, pos, has_gauss, cached_gaussian = state
+    return name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian
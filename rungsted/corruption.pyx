@@ -9,8 +9,9 @@ from rungsted.weights cimport WeightVector
 import numpy as np
 # cimport numpy as np
 
-from libc.stdint cimport uint32_t
+from libc.stdint cimport uint32_t, int32_t
 from libc.stdlib cimport rand
+from libc.string cimport memcpy
 
 
 cdef extern from "limits.h":
@@ -19,6 +20,33 @@ cdef extern from "limits.h":
 cdef extern from "stdlib.h":
     long random()
     void srandom(unsigned int seed)
+    char *initstate(unsigned int seed, char *state, size_t n)
+    char *setstate(char *state)
+
+
+# The state of random() is kept in our own buffer, so that it can be saved
+# and restored. 128 bytes seeded with 1 is the default state of the generator.
+DEF RANDOM_STATE_INTS = 32
+cdef int32_t random_state[RANDOM_STATE_INTS]
+cdef int32_t scratch_random_state[RANDOM_STATE_INTS]
+initstate(1, <char *> scratch_random_state, sizeof(scratch_random_state))
+initstate(1, <char *> random_state, sizeof(random_state))
+
+def get_random_state():
+    """Snapshot of the state of random(), which drives the corruption."""
+    # Activating the buffer writes the current position of the generator into it
+    setstate(<char *> random_state)
+    return (<char *> random_state)[:sizeof(random_state)]
+
+def set_random_state(bytes state):
+    if len(state) != sizeof(random_state):
+        raise ValueError("Invalid random state of {} bytes".format(len(state)))
+
+    # Switch away from the buffer first. Otherwise setstate would store
+    # the current position in the restored state.
+    setstate(<char *> scratch_random_state)
+    memcpy(random_state, <char *> state, sizeof(random_state))
+    setstate(<char *> random_state)
 
 cdef class FastBinomialCorruption(object):
     cdef:
@@ -1,6 +1,6 @@
 from libcpp.string cimport string
-from libc.stdint cimport uint32_t, int32_t
-from libcpp.unordered_map cimport unordered_map
+from libc.stdint cimport uint32_t, int32_t, uint64_t
+from libcpp.vector cimport vector
 
 cdef uint32_t hash_str(string to_hash, int bits)
 
@@ -30,4 +30,17 @@ cdef class DictFeatMap(FeatMap):
 cdef class CDictFeatMap(FeatMap):
     cdef:
         public int n_labels
-        unordered_map[string, int] feat2index
+        # Feature strings are interned back to back in `arena`. Feature i
+        # occupies the bytes from offsets[i] to offsets[i+1].
+        string arena
+        vector[uint64_t] offsets
+        vector[uint32_t] hashes
+        # Open addressing table of feature indices. Empty slots are -1.
+        vector[int32_t] slots
+        uint32_t slot_mask
+
+    cdef uint32_t _find_slot(self, const char *feat, size_t feat_len, uint32_t hash) nogil
+    cdef void _resize(self, uint32_t n_slots) nogil
+    cdef int32_t lookup(self, const char *feat, size_t feat_len) nogil
+    cdef int32_t feat_i_ptr(self, const char *feat, size_t feat_len) nogil
+
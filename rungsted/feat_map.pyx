@@ -3,14 +3,18 @@
 #cython: wraparound=False
 #cython: profile=False
 
-from libc.stdint cimport uint32_t, int32_t, int64_t, uint64_t
+from libc.stdint cimport uint8_t, uint32_t, int32_t, int64_t, uint64_t
 from libcpp.string cimport string
-from libcpp.unordered_map cimport unordered_map
+from libcpp.vector cimport vector
+from cpython.bytes cimport PyBytes_FromStringAndSize
+
+import numpy as np
 
 DEF MURMUR_SEED = 100
 
 cdef extern from "string.h":
     char * strncpy(char *, char *, size_t) nogil
+    int memcmp(const void *, const void *, size_t) nogil
     int strlen(char *) nogil
     void * memset(void *, int, size_t) nogil
 
@@ -165,28 +169,159 @@ cdef class DictFeatMap(FeatMap):
     cpdef int32_t n_feats(self):
         return self.next_i * self.n_labels
 
+# Initial number of slots in the CDictFeatMap table. Must be a power of 2
+DEF INITIAL_SLOTS = 1024
+
 cdef class CDictFeatMap(FeatMap):
+    """Feature map backed by a native hash table.
+
+    Feature strings are interned in a single arena and indexed by an open
+    addressing table with linear probing. Lookups work directly on
+    `(char*, len)` and do not need the GIL.
+    """
+    property feat2index_:
+        def __get__(self):
+            cdef int32_t i
+            return {PyBytes_FromStringAndSize(self.arena.data() + self.offsets[i],
+                                              self.offsets[i+1] - self.offsets[i]): i
+                    for i in range(self.next_i)}
+
+        def __set__(self, value):
+            cdef string feat
+            self._clear()
+            for feat, i in sorted(value.items(), key=lambda item: item[1]):
+                if self.feat_i_ptr(feat.c_str(), feat.size()) != i:
+                    raise ValueError("Feature indices must be consecutive and start at 0")
+
     def __init__(self):
-        self.next_i = 1
-    #     self.feat2index = {}
+        self._clear()
 
-    cdef int32_t feat_i(self, string feat):
-        cdef int key
-        key = self.feat2index[feat]
+    def _clear(self):
+        self.next_i = 0
+        self.arena.clear()
+        self.hashes.clear()
+        self.offsets.clear()
+        self.offsets.push_back(0)
+        self.slots.assign(INITIAL_SLOTS, -1)
+        self.slot_mask = INITIAL_SLOTS - 1
+
+    cdef uint32_t _find_slot(self, const char *feat, size_t feat_len, uint32_t hash) nogil:
+        # Returns the slot holding the feature, or the empty slot where it belongs
+        cdef:
+            uint32_t slot = hash & self.slot_mask
+            int32_t feat_i
+
+        while True:
+            feat_i = self.slots[slot]
+            if feat_i == -1:
+                return slot
+            if self.hashes[feat_i] == hash \
+                    and self.offsets[feat_i + 1] - self.offsets[feat_i] == feat_len \
+                    and memcmp(self.arena.data() + self.offsets[feat_i], feat, feat_len) == 0:
+                return slot
+            slot = (slot + 1) & self.slot_mask
+
+    cdef void _resize(self, uint32_t n_slots) nogil:
+        cdef:
+            int32_t feat_i
+            uint32_t slot
+
+        self.slots.assign(n_slots, -1)
+        self.slot_mask = n_slots - 1
+        # All features are distinct, so it suffices to find a free slot
+        for feat_i in range(self.next_i):
+            slot = self.hashes[feat_i] & self.slot_mask
+            while self.slots[slot] != -1:
+                slot = (slot + 1) & self.slot_mask
+            self.slots[slot] = feat_i
+
+    cdef int32_t lookup(self, const char *feat, size_t feat_len) nogil:
+        cdef uint32_t hash = 0
+        MurmurHash3_x86_32(feat, feat_len, MURMUR_SEED, &hash)
+        return self.slots[self._find_slot(feat, feat_len, hash)]
+
+    cdef int32_t feat_i_ptr(self, const char *feat, size_t feat_len) nogil:
+        cdef:
+            uint32_t hash = 0
+            uint32_t slot
+            int32_t key
 
-        if key == 0 and self.frozen == 1:
-            return -1
-        elif key > 0:
-            return key
-        else:
-            key = self.next_i
-            self.feat2index[feat] = key
-            self.next_i += 1
+        MurmurHash3_x86_32(feat, feat_len, MURMUR_SEED, &hash)
+        slot = self._find_slot(feat, feat_len, hash)
+        key = self.slots[slot]
+        if key != -1 or self.frozen == 1:
             return key
 
+        key = self.next_i
+        self.arena.append(feat, feat_len)
+        self.offsets.push_back(self.arena.size())
+        self.hashes.push_back(hash)
+        self.slots[slot] = key
+        self.next_i += 1
+
+        # Keep the load factor below 0.5
+        if 2 * <uint32_t> self.next_i > self.slots.size():
+            self._resize(2 * self.slots.size())
+
+        return key
+
+    cdef int32_t feat_i(self, string feat):
+        return self.feat_i_ptr(feat.c_str(), feat.size())
+
     cdef int32_t feat_i_for_label(self, uint32_t feat_i, uint32_t label) nogil:
         # The weight weight has `n_labels` sections, each with `next_i` entries
         return self.next_i * label + feat_i
 
     cpdef int32_t n_feats(self):
-        return self.next_i * self.n_labels
\ No newline at end of file
+        return self.next_i * self.n_labels
+
+    def compact(self, keep):
+        """Return a new feature map with the features for which `keep` is true,
+        numbered consecutively in their original order."""
+        cdef:
+            CDictFeatMap compacted = CDictFeatMap()
+            uint8_t [::1] keep_view = np.ascontiguousarray(keep, dtype=np.uint8)
+            int32_t i
+
+        if keep_view.shape[0] != self.next_i:
+            raise ValueError("Expected {} values in keep, got {}".format(self.next_i, keep_view.shape[0]))
+
+        for i in range(self.next_i):
+            if keep_view[i]:
+                compacted.feat_i_ptr(self.arena.data() + self.offsets[i], self.offsets[i + 1] - self.offsets[i])
+
+        compacted.n_labels = self.n_labels
+        return compacted
+
+    def save(self, file):
+        cdef uint64_t [::1] offsets = <uint64_t[:self.offsets.size()]> self.offsets.data()
+        np.savez(file,
+                 arena=np.frombuffer(self.arena, dtype=np.uint8),
+                 lengths=np.diff(offsets).astype(np.uint32),
+                 n_labels=self.n_labels)
+
+    @classmethod
+    def load(cls, file):
+        cdef:
+            CDictFeatMap feat_map = cls()
+            uint32_t [::1] lengths
+            uint32_t hash
+            uint32_t n_slots = INITIAL_SLOTS
+            int32_t i
+
+        with np.load(file) as npz_file:
+            feat_map.arena = npz_file['arena'].tobytes()
+            lengths = np.ascontiguousarray(npz_file['lengths'], dtype=np.uint32)
+            feat_map.n_labels = int(npz_file['n_labels'])
+
+        feat_map.next_i = lengths.shape[0]
+        for i in range(feat_map.next_i):
+            feat_map.offsets.push_back(feat_map.offsets[i] + lengths[i])
+            MurmurHash3_x86_32(feat_map.arena.data() + feat_map.offsets[i], lengths[i], MURMUR_SEED, &hash)
+            feat_map.hashes.push_back(hash)
+
+        while n_slots < 2 * <uint32_t> feat_map.next_i:
+            n_slots *= 2
+        feat_map._resize(n_slots)
+
+        return feat_map
@@ -1,6 +1,6 @@
 
-from libc.stdio cimport FILE, sscanf
-from libc.stdint cimport uint8_t
+from libc.stdio cimport sscanf
+from libc.stdint cimport uint8_t, int32_t
 from libc.stdlib cimport free, malloc
 from libcpp.string cimport string
 from libcpp cimport bool
@@ -8,18 +8,27 @@ from libcpp cimport bool
 
 
 from cython.operator cimport dereference as deref
+import bz2
+import gzip
+import lzma
+import io
 import numpy as np
+import os
+import queue
+import stat
+import sys
+import threading
 cimport numpy as cnp
 from cpython cimport array
 
 from rungsted.feat_map cimport FeatMap, hash_str
 
-cnp.import_array()
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-cdef extern from "stdio.h":
-    FILE *fopen(const char *, const char *)
-    int fclose(FILE *)
-    ssize_t getline(char **, size_t *, FILE *)
+cnp.import_array()
 
 cdef extern from "stdlib.h":
      double strtod(const char *restrict, char **restrict)
@@ -39,6 +48,11 @@ from libc.stdlib cimport rand
 
 
 DEF MAX_LEN = 2048
+# Read-ahead of the input. Blocks of lines from files are roughly READ_AHEAD_BLOCK_SIZE bytes,
+# and at most READ_AHEAD_BLOCKS of them are kept in memory. Blocks from pipes hold the lines
+# available at the time of reading.
+DEF READ_AHEAD_BLOCK_SIZE = 1 << 20
+DEF READ_AHEAD_BLOCKS = 16
 DEF MAX_FEAT_NAME_LEN = 1024
 cdef const char * DEFAULT_ID = b"default"
 # FIXME should really be imported from the string
@@ -47,6 +61,123 @@ cdef size_t npos = -1
 cdef FeatMap feature_map_global
 
 
+def open_input(filename):
+    """Open `filename` for reading bytes. The name `-` refers to standard input.
+
+    Compressed input (gzip, bzip2, xz and, if the zstandard package is installed,
+    zstd) is recognized by its magic number and decompressed transparently.
+    """
+    if filename == '-':
+        raw = sys.stdin.buffer
+    else:
+        try:
+            raw = open(filename, 'rb')
+        except IOError:
+            raise ValueError(2, "No such file or directory: '%s'" % filename)
+
+    magic = raw.peek(6)[:6]
+    if magic.startswith(b'\x1f\x8b'):
+        return gzip.GzipFile(fileobj=raw)
+    elif magic.startswith(b'BZh'):
+        return bz2.BZ2File(raw)
+    elif magic.startswith(b'\xfd7zXZ\x00'):
+        return lzma.LZMAFile(raw)
+    elif magic.startswith(b'\x28\xb5\x2f\xfd'):
+        if zstandard is None:
+            raise ValueError("Reading zstd compressed input requires the zstandard package: '%s'" % filename)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+    else:
+        return raw
+
+
+class ReadAhead(object):
+    """Iterate over the lines of a file, while a background thread reads and
+    decompresses the following blocks of lines.
+
+    Use as a context manager, which stops the thread. The thread closes the file.
+    """
+    def __init__(self, file, block_size=READ_AHEAD_BLOCK_SIZE, max_blocks=READ_AHEAD_BLOCKS):
+        self.file = file
+        self.block_size = block_size
+        self.blocks = queue.Queue(max_blocks)
+        self.closed = False
+        # Reads from pipes and terminals can block indefinitely
+        self.may_block = not is_regular_file(file)
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _put(self, block):
+        # Give up when the consumer is gone
+        while not self.closed:
+            try:
+                self.blocks.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fill(self):
+        rest = b''
+        eof = False
+        try:
+            while not self.closed and not eof:
+                chunks = [rest]
+                size = 0
+                while size < self.block_size:
+                    # read1 returns what is available, e.g. one decompressed chunk of a gzip file
+                    data = self.file.read1(self.block_size - size)
+                    if not data:
+                        eof = True
+                        break
+                    chunks.append(data)
+                    size += len(data)
+                    # Hand lines from a pipe over as they arrive, instead of waiting for a full block
+                    if self.may_block:
+                        break
+
+                data = b''.join(chunks)
+                end = len(data) if eof else data.rfind(b'\n') + 1
+                rest = data[end:]
+                if end:
+                    self._put(io.BytesIO(data[:end]).readlines())
+            if eof:
+                self._put([])
+        except Exception as e:
+            self._put(e)
+        finally:
+            if self.file is not sys.stdin.buffer:
+                self.file.close()
+
+    def __iter__(self):
+        while True:
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                break
+            for line in block:
+                yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.closed = True
+        # A thread blocked reading a pipe cannot be interrupted. It is a daemon,
+        # and stops after its current read.
+        if not self.may_block:
+            self.thread.join()
+
+
+def is_regular_file(file):
+    try:
+        return stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+    except (AttributeError, OSError):
+        return False
+
+
 cdef class Sequence(object):
     def __cinit(self):
         pass
@@ -294,6 +425,12 @@ cdef void add_feature(Example *example, int feat_i, double value):
     feat.value = value
     example.features.push_back(feat)
 
+cdef void add_constant_feature(Example *example, FeatMap feat_map):
+    # The constant feature is absent from frozen maps that were pruned
+    cdef int32_t feat_i = feat_map.feat_i(b"^Constant")
+    if feat_i >= 0:
+        add_feature(example, feat_i, 1)
+
 cdef void add_partial(Example *example, PartialExample *partial, int audit):
     global feature_map_global
     cdef FeatMap feat_map = feature_map_global
@@ -403,12 +540,7 @@ cdef int parse_features2(Example * e, int audit, PartialExample *partial) except
 
 def read_vw_seq(filename, FeatMap feat_map, quadratic=[], ignore=[], labels=None, audit=False, require_labels=False):
     cdef:
-        char* fname
-        FILE* cfile
-        char * line = NULL
         unsigned int bar_pos
-        size_t l = 0
-        ssize_t read
         double instance_weight
         size_t id_len
         Example e
@@ -432,58 +564,274 @@ def read_vw_seq(filename, FeatMap feat_map, quadratic=[], ignore=[], labels=None
     e = example_new(dataset)
     seq = Sequence()
 
-    cfile = fopen(bytes(filename, encoding='utf-8'), b"rb")
+    global feature_map_global
+    feature_map_global = feat_map
+    with ReadAhead(open_input(filename)) as lines:
+        for line in lines:
+            line_str = line
+            if line_str[line_str.size() - 1] != b'\n':
+                line_str.push_back(b'\n')
 
+            if line_str.size() > 1:
+                e = example_new(dataset)
 
-    if cfile == NULL:
-        raise ValueError(2, "No such file or directory: '%s'" % filename)
+                bar_pos = line_str.find(b'|')
 
-    global feature_map_global
-    feature_map_global = feat_map
-    while True:
-        read = getline(&line, &l, cfile)
-        if read == -1:
-            if seq.examples.size() > 0:
-                seqs.append(seq)
+                if bar_pos == npos:
+                    raise ValueError("Missing | character in example")
+
+                header = line_str.substr(0, bar_pos)
+                parse_header(header, label_map, &e, audit)
+                if require_labels and e.labels.size() == 0:
+                    raise ValueError("Missing label in example: {}".format(line))
+
+
+                feature_section = line_str.substr(bar_pos)
+                partial.feature_str = &feature_section
+                parse_features2(&e, audit, &partial)
+
+                # Add constant feature
+                add_constant_feature(&e, feat_map)
+
+                seq.examples.push_back(e)
+
+                if audit:
+                    print("")
+
+            else:
+                # Empty line. Multiple empty lines after each other are ignored
+                if seq.examples.size() > 0:
+                    seqs.append(seq)
+                    seq = Sequence()
+
+    if seq.examples.size() > 0:
+        seqs.append(seq)
+
+    # Create label list from label map
+    rev_map = dict((v, k) for k, v in label_map.items())
+    labels = [rev_map[i] for i in range(len(rev_map))]
+
+    return seqs, labels
+
+
+# Feature templates understood by `read_conll_seq`. They generate the same
+# features as the corresponding extractors in `datasets/pos_features.py`.
+DEF TASKAR12 = 0
+DEF HONNIBAL13 = 1
+DEF HONNIBAL13_GROUPS = 2
+
+CONLL_FEATURE_SETS = {
+    'taskar12': TASKAR12,
+    'honnibal13': HONNIBAL13,
+    'honnibal13-groups': HONNIBAL13_GROUPS
+}
+
+cdef struct ConllToken:
+    string norm
+    string pref1
+    string suf2
+    string suf3
+    bool upper
+    bool digit
+
+
+cdef int conll_token_init(ConllToken *token, unicode word) except -1:
+    cdef unicode norm, c
+
+    # Years and other numbers are collapsed into two word classes.
+    # Unlike isdigit(), isdecimal() only accepts characters that int() can parse.
+    if word.isdecimal():
+        word = "!YEAR" if 1800 <= int(word) <= 2100 else "!DIGITS"
+
+    norm = word.lower().replace(":", "COL")
+    token.norm = norm.encode('utf-8')
+    token.pref1 = norm[:1].encode('utf-8')
+    token.suf2 = norm[-2:].encode('utf-8')
+    token.suf3 = norm[-3:].encode('utf-8')
+    token.upper = word[0].isupper()
+    token.digit = False
+    for c in norm:
+        if c.isdigit():
+            token.digit = True
             break
 
-        line_str = string(line)
-        if line_str[line_str.size() - 1] != b'\n':
-            line_str.push_back(b'\n')
+    return 0
+
+
+cdef bytes normalize_conll_label(unicode label):
+    label = label.replace("``", "O_QUOT")\
+        .replace("''", "C_QUOT")\
+        .replace("'", "S_QUOT")\
+        .replace(':', 'COL')\
+        .replace('?', 'QMARK')
+
+    if not len(label):
+        label = "*EMPTY*"
 
-        if line_str.size() > 1:
-            e = example_new(dataset)
+    return label.encode('utf-8')
 
-            bar_pos = line_str.find(b'|')
 
-            if bar_pos == npos:
-                raise ValueError("Missing | character in example")
+cdef int add_template(Example *e, FeatMap feat_map, string name, string value, int audit) except -1:
+    cdef int32_t feat_i
+    cdef string feat = b"^"
 
-            header = line_str.substr(0, bar_pos)
-            parse_header(header, label_map, &e, audit)
-            if require_labels and e.labels.size() == 0:
-                raise ValueError("Missing label in example: {}".format(line))
+    feat.append(name)
+    if not value.empty():
+        feat.push_back(b'=')
+        feat.append(value)
 
+    feat_i = feat_map.feat_i(feat)
+    if feat_i >= 0:
+        add_feature(e, feat_i, 1.0)
+        if audit:
+            print("{}:{}=>{}".format(feat, 1.0, feat_i), end=' ')
 
-            feature_section = line_str.substr(bar_pos)
-            partial.feature_str = &feature_section
-            parse_features2(&e, audit, &partial)
+    return 0
 
-            # Add constant feature
-            add_feature(&e, feat_map.feat_i(b"^Constant"), 1)
 
-            seq.examples.push_back(e)
+cdef int add_grouped_template(Example *e, FeatMap feat_map, string name, string value, string group,
+                              int audit) except -1:
+    value.push_back(b'@')
+    value.append(group)
+    return add_template(e, feat_map, name, value, audit)
+
+
+cdef int conll_features(Example *e, FeatMap feat_map, int feature_set, vector[ConllToken] &tokens, int i,
+                        int audit) except -1:
+    cdef int n = tokens.size()
+
+    if feature_set == TASKAR12:
+        add_template(e, feat_map, b"w", tokens[i].norm, audit)
+        add_template(e, feat_map, b"suf2", tokens[i].suf2, audit)
+        add_template(e, feat_map, b"suf3", tokens[i].suf3, audit)
+        if tokens[i].upper:
+            add_template(e, feat_map, b"uppercased", b"", audit)
+        if tokens[i].digit:
+            add_template(e, feat_map, b"hasdigit", b"", audit)
+
+    elif feature_set == HONNIBAL13:
+        add_template(e, feat_map, b"w", tokens[i].norm, audit)
+        add_template(e, feat_map, b"pref1", tokens[i].pref1, audit)
+        add_template(e, feat_map, b"suf3", tokens[i].suf3, audit)
+        if i > 0:
+            add_template(e, feat_map, b"<w", tokens[i-1].norm, audit)
+            add_template(e, feat_map, b"<suf3", tokens[i-1].suf3, audit)
+        if i > 1:
+            add_template(e, feat_map, b"<<w", tokens[i-2].norm, audit)
+        if i < n - 1:
+            add_template(e, feat_map, b">w", tokens[i+1].norm, audit)
+            add_template(e, feat_map, b">suf3", tokens[i+1].suf3, audit)
+        if i < n - 2:
+            add_template(e, feat_map, b">>w", tokens[i+2].norm, audit)
+
+    elif feature_set == HONNIBAL13_GROUPS:
+        # Word identity features are grouped by the word itself
+        add_grouped_template(e, feat_map, b"w", tokens[i].norm, tokens[i].norm, audit)
+        add_template(e, feat_map, b"pref1", tokens[i].pref1, audit)
+        add_template(e, feat_map, b"suf3", tokens[i].suf3, audit)
+        if i > 0:
+            add_grouped_template(e, feat_map, b"<w", tokens[i-1].norm, tokens[i-1].norm, audit)
+            add_template(e, feat_map, b"<suf3", tokens[i-1].suf3, audit)
+        if i > 1:
+            add_grouped_template(e, feat_map, b"<<w", tokens[i-2].norm, tokens[i-2].norm, audit)
+        if i < n - 1:
+            add_grouped_template(e, feat_map, b">w", tokens[i+1].norm, tokens[i+1].norm, audit)
+            add_template(e, feat_map, b">suf3", tokens[i+1].suf3, audit)
+        if i < n - 2:
+            add_grouped_template(e, feat_map, b">>w", tokens[i+2].norm, tokens[i+2].norm, audit)
 
-            if audit:
-                print("")
+    return 0
 
-        else:
-            # Empty line. Multiple empty lines after each other are ignored
-            if seq.examples.size() > 0:
-                seqs.append(seq)
-                seq = Sequence()
 
-    free(line)
+cdef Sequence conll_sequence(list words, list tags, Dataset dataset, FeatMap feat_map, int feature_set,
+                             dict label_map, unicode name, int sent_i, int audit):
+    cdef:
+        Sequence seq = Sequence()
+        vector[ConllToken] tokens
+        ConllToken token
+        Example e
+        LabelCost label_cost
+        int i
+
+    for word in words:
+        conll_token_init(&token, word)
+        tokens.push_back(token)
+
+    for i in range(tokens.size()):
+        e = example_new(dataset)
+        e.id_ = strdup("{}-{}-{}".format(name, sent_i, i + 1).encode('utf-8'))
+
+        label_cost = map_label(normalize_conll_label(tags[i]), label_map)
+        e.labels.push_back(label_cost)
+        e.gold_label = label_cost.label
+
+        if audit:
+            print("{}:{} '{}|".format(label_cost.label, label_cost.cost, e.id_), end=' ')
+
+        conll_features(&e, feat_map, feature_set, tokens, i, audit)
+
+        # Add constant feature
+        add_constant_feature(&e, feat_map)
+
+        seq.examples.push_back(e)
+
+        if audit:
+            print("")
+
+    return seq
+
+
+def read_conll_seq(filename, FeatMap feat_map, feature_set='honnibal13', coarse=False, name='d', labels=None,
+                   audit=False):
+    """Read a CoNLL-formatted treebank directly into sequences.
+
+    Features are extracted natively with the templates of `feature_set`,
+    producing the same feature indices as running `datasets/conll_to_vw.py`
+    followed by `read_vw_seq`, without the intermediate VW file.
+    """
+    cdef:
+        Dataset dataset
+        Sequence seq
+        int sent_i = 1
+        int tag_col = 3 if coarse else 4
+
+    if feature_set not in CONLL_FEATURE_SETS:
+        raise ValueError("Unknown feature set: {}. Use one of {}".format(
+            feature_set, ", ".join(sorted(CONLL_FEATURE_SETS))))
+
+    label_map = {}
+    if labels:
+        for i, label_name in enumerate(labels):
+            label_map[label_name] = i
+
+    dataset = dataset_new([], [])
+    seqs = []
+
+    # Sentences are processed one at a time. Lookups in a CDictFeatMap do not need the GIL,
+    # but words are normalised with Python unicode methods, which do. Features also get
+    # their indices in order of first appearance while the map is not frozen.
+    words = []
+    tags = []
+    with ReadAhead(open_input(filename)) as lines:
+        for line in lines:
+            parts = line.decode('utf-8').split()
+            if len(parts) == 10:
+                words.append(parts[1])
+                tags.append(parts[tag_col])
+            elif len(parts) == 0:
+                if words:
+                    seq = conll_sequence(words, tags, dataset, feat_map, CONLL_FEATURE_SETS[feature_set],
+                                         label_map, name, sent_i, audit)
+                    seqs.append(seq)
+                sent_i += 1
+                words = []
+                tags = []
+            else:
+                raise ValueError("Invalid CoNLL line (expected 10 columns): {}".format(line.decode('utf-8')))
+
+    if words:
+        seqs.append(conll_sequence(words, tags, dataset, feat_map, CONLL_FEATURE_SETS[feature_set],
+                                   label_map, name, sent_i, audit))
 
     # Create label list from label map
     rev_map = dict((v, k) for k, v in label_map.items())
@@ -22,11 +22,12 @@ from os.path import exists, join
 import time
 
 from rungsted.decoding import Viterbi as ViterbiStd
+from rungsted.checkpoint import Checkpointer, load_checkpoint, restore_random_state
 from rungsted.corruption import FastBinomialCorruption, RecycledDistributionCorruption, inverse_zipfian_sampler, \
     AdversialCorruption
-from rungsted.feat_map import HashingFeatMap, DictFeatMap
+from rungsted.feat_map import HashingFeatMap, CDictFeatMap
 
-from rungsted.input import read_vw_seq
+from rungsted.input import read_vw_seq, read_conll_seq, CONLL_FEATURE_SETS
 from rungsted.timer import Timer
 from rungsted.struct_perceptron import avg_loss, accuracy, update_weights, update_weights_confusion, update_weights_cs_sample
 
@@ -35,14 +36,72 @@ from rungsted import weights
 from rungsted.weights import WeightVector, ScaledWeightVector
 
 
+def train_passes(train, transition, emission, feat_map, labels, passes, weight_updater=update_weights,
+                 update_args=(), corrupter=None, checkpointer=None, checkpoint_every=None, progress=None):
+    """Train on the sequences in `train` up to pass number `passes`. Returns the number of passes made.
+
+    With a `checkpointer`, the training state is saved after each pass and, if
+    `checkpoint_every` is given, every `checkpoint_every` sentences. Training
+    continues from `progress`, the progress of a loaded checkpoint, if given.
+    """
+    n_labels = len(labels)
+    vit = ViterbiStd(n_labels, transition, emission, feat_map)
+
+    start_epoch, start_sent, n_updates = 1, 0, 0
+    if progress:
+        start_epoch, start_sent, n_updates = progress['epoch'], progress['sentence'], progress['n_updates']
+        restore_random_state(progress)
+        logging.info("Resuming training at pass {}, sentence {}".format(start_epoch, start_sent))
+
+    epoch = start_epoch - 1
+    for epoch in range(start_epoch, passes+1):
+        for sent_i, sent in enumerate(train):
+            # Skip the sentences trained on before the checkpoint
+            if epoch == start_epoch and sent_i < start_sent:
+                continue
+            if corrupter:
+                corrupter.corrupt_sequence(sent, emission, transition)
+            vit.decode(sent)
+            weight_updater(sent, transition, emission, 0.1, n_labels, feat_map, *update_args)
+
+            n_updates += 1
+            transition.update_done()
+            emission.update_done()
+
+            if n_updates % 1000 == 0:
+                print('\r[{}] {}k sentences total'.format(epoch, n_updates / 1000), file=sys.stderr)
+
+            if checkpointer and checkpoint_every and n_updates % checkpoint_every == 0:
+                checkpointer.save(transition, emission, feat_map, labels,
+                                  dict(epoch=epoch, sentence=sent_i + 1, n_updates=n_updates))
+
+        epoch_msg = "[{}] train loss={:.4f} ".format(epoch, avg_loss(train))
+        print("\r{}{}".format(epoch_msg, " "*72), file=sys.stderr)
+
+        if checkpointer:
+            checkpointer.save(transition, emission, feat_map, labels,
+                              dict(epoch=epoch + 1, sentence=0, n_updates=n_updates))
+
+    if checkpointer:
+        checkpointer.wait()
+
+    return epoch - start_epoch + 1
 
 
 def main():
     logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
     parser = argparse.ArgumentParser(description="""Structured perceptron tagger.""")
-    parser.add_argument('--train', help="Training data (vw format).")
-    parser.add_argument('--test', help="Test data (vw format).")
+    parser.add_argument('--train', help="Training data (vw format). May be compressed (gzip, bzip2, xz or zstd). "
+                                        "Use - for standard input.")
+    parser.add_argument('--test', help="Test data (vw format). May be compressed (gzip, bzip2, xz or zstd). "
+                                       "Use - for standard input.")
+    parser.add_argument('--input-format', help="Format of training and test data. With 'conll', features are "
+                                               "extracted directly from the treebank columns.",
+                        choices=['vw', 'conll'], default='vw')
+    parser.add_argument('--feature-set', help="Feature templates for CoNLL input.",
+                        choices=sorted(CONLL_FEATURE_SETS), default='honnibal13')
+    parser.add_argument('--coarse', help="Use coarse-grained tags of CoNLL input.", action='store_true')
     parser.add_argument('--hash-bits', '-b', help="Size of feature vector in bits (2**b).", type=int)
     parser.add_argument('--passes', help="Number of passes over the training set.", type=int, default=5)
     parser.add_argument('--predictions', '-p', help="File for outputting predictions.")
@@ -56,6 +115,11 @@ def main():
     parser.add_argument('--initial-model', '-i', help="Initial model from this file.")
     parser.add_argument('--base-weights', help="Use initial model as base weights.", action='store_true')
     parser.add_argument('--final-model', '-f', help="Save model here after training.")
+    parser.add_argument('--checkpoint-dir', help="Save checkpoints of the training state in this directory "
+                                                 "after each pass.")
+    parser.add_argument('--checkpoint-every', help="Also save a checkpoint every N sentences.", type=int)
+    parser.add_argument('--resume', help="Resume training from the latest checkpoint in this directory. "
+                                         "Checkpoints continue to be saved here, unless --checkpoint-dir is given.")
     parser.add_argument('--cost-sensitive', '--cs', help="Cost-sensitive weight updates", action='store_true')
     parser.add_argument('--l2-decay', help="Shrink weights by this factor after each update.", type=float)
     parser.add_argument('--append-test', help="Append test result as JSON object to this file.")
@@ -76,6 +140,8 @@ def main():
         parser.print_usage()
         exit(1)
 
+    if args.checkpoint_every and not (args.checkpoint_dir or args.resume):
+        parser.error("--checkpoint-every requires --checkpoint-dir or --resume")
 
     timers = defaultdict(lambda: Timer())
     logging.info("Tagger started. \nCalled with {}".format(args))
@@ -83,7 +149,7 @@ def main():
     if args.hash_bits:
         feat_map = HashingFeatMap(args.hash_bits)
     else:
-        feat_map = DictFeatMap()
+        feat_map = CDictFeatMap()
 
     weight_updater = update_weights
     if args.cost_sensitive:
@@ -99,14 +165,28 @@ def main():
     else:
         WV = WeightVector
 
+    checkpoint = None
+    if args.resume:
+        checkpoint = load_checkpoint(args.resume)
+        labels = checkpoint['labels']
+        if 'feat_map' in checkpoint:
+            feat_map = checkpoint['feat_map']
+        if not args.checkpoint_dir:
+            args.checkpoint_dir = args.resume
+
     if args.initial_model:
         wt = WV.load(join(args.initial_model, 'transition.npz'), l2_decay=args.l2_decay)
         we = WV.load(join(args.initial_model, 'emission.npz'), l2_decay=args.l2_decay)
 
         labels = list(np.load(join(args.initial_model, 'labels.npy')))
         if not args.hash_bits:
-            pickle_filename = join(args.initial_model, 'feature_map.pickle')
-            feat_map.feat2index_ = pickle.load(open(pickle_filename, 'rb'))
+            feat_map_filename = join(args.initial_model, 'feature_map.npz')
+            if exists(feat_map_filename):
+                feat_map = CDictFeatMap.load(feat_map_filename)
+            else:
+                # Models saved by earlier versions pickle the feature dictionary
+                pickle_filename = join(args.initial_model, 'feature_map.pickle')
+                feat_map.feat2index_ = pickle.load(open(pickle_filename, 'rb'))
 
         if args.base_weights:
             wt.base = wt.w
@@ -114,11 +194,18 @@ def main():
             we.base = we.w
             we.w = np.zeros_like(we.w)
 
+    def read_input(filename, labels, require_labels=False):
+        if args.input_format == 'conll':
+            return read_conll_seq(filename, feat_map, feature_set=args.feature_set, coarse=args.coarse,
+                                  labels=labels, audit=args.audit)
+        else:
+            return read_vw_seq(filename, ignore=args.ignore, quadratic=args.quadratic, feat_map=feat_map,
+                               labels=labels, audit=args.audit, require_labels=require_labels)
+
     train = None
     if args.train:
-        train, train_labels = read_vw_seq(args.train, ignore=args.ignore, quadratic=args.quadratic, feat_map=feat_map,
-                                          labels=labels, audit=args.audit, require_labels=True)
-        if args.initial_model:
+        train, train_labels = read_input(args.train, labels, require_labels=True)
+        if args.initial_model or args.resume:
             assert len(labels) == len(train_labels), \
                 "Labels from training data not found in saved model".format(set(train_labels) - set(labels))
         labels = train_labels
@@ -128,8 +215,7 @@ def main():
     feat_map.freeze()
     test = None
     if args.test:
-        test, test_labels = read_vw_seq(args.test, ignore=args.ignore, quadratic=args.quadratic, feat_map=feat_map,
-                                        labels=labels, audit=args.audit)
+        test, test_labels = read_input(args.test, labels)
         if args.initial_model:
             assert len(labels) == len(test_labels), \
                 "Labels from test data not found in saved model: {}".format(set(test_labels) - set(labels))
@@ -141,11 +227,18 @@ def main():
         feat_map.n_labels = n_labels
 
     # Loading weights
-    if not args.initial_model:
+    if args.resume:
+        wt = WV.from_state(checkpoint['transition'])
+        we = WV.from_state(checkpoint['emission'])
+    elif not args.initial_model:
         wt = WV((n_labels + 2, n_labels + 2),
                           ada_grad=args.ada_grad, l2_decay=args.l2_decay)
         we = WV(feat_map.n_feats(),
                           ada_grad=args.ada_grad, l2_decay=args.l2_decay)
+    elif not args.hash_bits and feat_map.n_feats() > we.n:
+        # The training data has features the initial model does not, e.g. because it was pruned.
+        # Weights are stored per label section, so every section moves.
+        we.grow(n_labels, feat_map.n_feats() // n_labels)
 
     logging.info("Weight vector sizes. Transition={}. Emission={}".format(wt.dims, we.dims))
 
@@ -170,32 +263,15 @@ def main():
     Viterbi = ViterbiStd
 
     def do_train(transition, emission):
-        vit = Viterbi(n_labels, transition, emission, feat_map)
+        checkpointer = Checkpointer(args.checkpoint_dir) if args.checkpoint_dir else None
+        update_args = (confusion_scaling,) if args.confusion_scaling else ()
 
         timers['train'].begin()
-        n_updates = 0
-        for epoch in range(1, args.passes+1):
-            for sent in train:
-                if args.drop_out:
-                    corrupter.corrupt_sequence(sent, emission, transition)
-                vit.decode(sent)
-                if args.confusion_scaling:
-                    weight_updater(sent, transition, emission, 0.1, n_labels, feat_map, confusion_scaling)
-                else:
-                    weight_updater(sent, transition, emission, 0.1, n_labels, feat_map)
-
-                n_updates += 1
-                transition.update_done()
-                emission.update_done()
-                # print("Scaling", emission.scaling)
-
-                if n_updates % 1000 == 0:
-                    print('\r[{}] {}k sentences total'.format(epoch, n_updates / 1000), file=sys.stderr)
-
-
-            epoch_msg = "[{}] train loss={:.4f} ".format(epoch, avg_loss(train))
-            print("\r{}{}".format(epoch_msg, " "*72), file=sys.stderr)
-
+        n_passes = train_passes(train, transition, emission, feat_map, labels, args.passes,
+                                weight_updater=weight_updater, update_args=update_args,
+                                corrupter=corrupter if args.drop_out else None, checkpointer=checkpointer,
+                                checkpoint_every=args.checkpoint_every,
+                                progress=checkpoint['progress'] if checkpoint else None)
         timers['train'].end()
 
         # Rescale
@@ -206,7 +282,7 @@ def main():
             transition.average()
             emission.average()
 
-        tokens_trained = epoch * sum(len(seq) for seq in train)
+        tokens_trained = n_passes * sum(len(seq) for seq in train)
         print("Training took {:.2f} secs. {} words/sec".format(timers['train'].elapsed(),
                                                                              int(tokens_trained / timers['train'].elapsed())),
               file=sys.stderr)
@@ -276,8 +352,7 @@ def main():
         json.dump(args.__dict__, open(join(args.final_model, 'settings.json'), 'w'))
 
         if not args.hash_bits:
-            with open(join(args.final_model, 'feature_map.pickle'), 'wb') as out:
-                pickle.dump(feat_map.feat2index_, out)
+            feat_map.save(join(args.final_model, 'feature_map.npz'))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
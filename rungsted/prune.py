@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Pruning of trained models.
+
+Features whose emission weights are negligible for every label are removed,
+and the remaining features are renumbered densely. The pruned model is
+smaller and faster to load. Pruning only features with all-zero weights
+gives a model that tags identically to the original.
+"""
+import argparse
+import json
+import logging
+import os
+import pickle
+import shutil
+from os.path import exists, getsize, join
+
+import numpy as np
+
+from rungsted.decoding import Viterbi
+from rungsted.feat_map import CDictFeatMap
+from rungsted.input import read_vw_seq, read_conll_seq
+from rungsted.struct_perceptron import accuracy
+from rungsted.weights import WeightVector
+
+MODEL_FILES = ['transition.npz', 'emission.npz', 'labels.npy', 'feature_map.npz', 'feature_map.pickle']
+
+
+def load_feat_map(model_dir):
+    feat_map_filename = join(model_dir, 'feature_map.npz')
+    pickle_filename = join(model_dir, 'feature_map.pickle')
+    if exists(feat_map_filename):
+        return CDictFeatMap.load(feat_map_filename)
+    elif exists(pickle_filename):
+        # Models saved by earlier versions pickle the feature dictionary
+        feat_map = CDictFeatMap()
+        feat_map.feat2index_ = pickle.load(open(pickle_filename, 'rb'))
+        return feat_map
+    else:
+        raise ValueError("Only models with a feature dictionary can be pruned. "
+                         "No feature map found in {}".format(model_dir))
+
+
+def prune_model(model_dir, out_dir, threshold=0.0, top_k=None):
+    """Save a pruned copy of the model in `model_dir` to `out_dir`.
+
+    Features whose absolute emission weight is at most `threshold` for all labels
+    are dropped. If `top_k` is given, at most the `top_k` remaining features with the
+    largest L2 norm over the labels are kept. Returns the number of features
+    before and after pruning.
+    """
+    labels = list(np.load(join(model_dir, 'labels.npy')))
+    n_labels = len(labels)
+    feat_map = load_feat_map(model_dir)
+    feat_map.n_labels = n_labels
+    emission = WeightVector.load(join(model_dir, 'emission.npz'))
+
+    n_feats = feat_map.n_feats() // n_labels
+    if n_feats * n_labels != emission.n:
+        raise ValueError("Emission weights of size {} do not match {} labels and {} features".format(
+            emission.n, n_labels, n_feats))
+
+    # Weights are laid out in `n_labels` sections, each with `n_feats` entries
+    w = np.asarray(emission.w).reshape(n_labels, n_feats)
+    keep = np.abs(w).max(axis=0) > threshold
+    if top_k is not None and keep.sum() > top_k:
+        norms = np.where(keep, np.linalg.norm(w, axis=0), -1)
+        keep = np.zeros_like(keep)
+        keep[np.argsort(-norms, kind='mergesort')[:top_k]] = True
+
+    pruned_map = feat_map.compact(keep)
+    n_kept = pruned_map.n_feats() // n_labels
+
+    # Compact all per-feature arrays
+    keep_cols = np.flatnonzero(keep)
+    emission.w = np.ascontiguousarray(w[:, keep_cols]).ravel()
+    emission.acc = np.asarray(emission.acc).reshape(n_labels, n_feats)[:, keep_cols].ravel()
+    emission.adagrad_squares = np.asarray(emission.adagrad_squares).reshape(n_labels, n_feats)[:, keep_cols].ravel()
+    emission.last_update = np.asarray(emission.last_update).reshape(n_labels, n_feats)[:, keep_cols].ravel()
+    emission.n = n_kept * n_labels
+    emission.dims = (emission.n,)
+
+    if not exists(out_dir):
+        os.makedirs(out_dir)
+
+    emission.save(join(out_dir, 'emission.npz'))
+    pruned_map.save(join(out_dir, 'feature_map.npz'))
+    shutil.copy(join(model_dir, 'transition.npz'), join(out_dir, 'transition.npz'))
+    shutil.copy(join(model_dir, 'labels.npy'), join(out_dir, 'labels.npy'))
+
+    settings_filename = join(model_dir, 'settings.json')
+    settings = json.load(open(settings_filename)) if exists(settings_filename) else {}
+    settings['pruned'] = {'model': model_dir, 'threshold': threshold, 'top_k': top_k,
+                          'n_feats': n_feats, 'n_kept': n_kept}
+    json.dump(settings, open(join(out_dir, 'settings.json'), 'w'))
+
+    return n_feats, n_kept
+
+
+def evaluate(model_dir, test_file):
+    """Tag `test_file` with the model in `model_dir`. Returns the accuracy and the predicted labels."""
+    settings_filename = join(model_dir, 'settings.json')
+    settings = json.load(open(settings_filename)) if exists(settings_filename) else {}
+
+    labels = list(np.load(join(model_dir, 'labels.npy')))
+    transition = WeightVector.load(join(model_dir, 'transition.npz'))
+    emission = WeightVector.load(join(model_dir, 'emission.npz'))
+    feat_map = load_feat_map(model_dir)
+    feat_map.n_labels = len(labels)
+    feat_map.freeze()
+
+    if settings.get('input_format') == 'conll':
+        test, _ = read_conll_seq(test_file, feat_map, feature_set=settings.get('feature_set', 'honnibal13'),
+                                 coarse=settings.get('coarse', False), labels=labels)
+    else:
+        test, _ = read_vw_seq(test_file, feat_map, quadratic=settings.get('quadratic', []),
+                              ignore=settings.get('ignore', []), labels=labels)
+
+    vit = Viterbi(len(labels), transition, emission, feat_map)
+    for sent in test:
+        vit.decode(sent)
+
+    return accuracy(test), [sent.pred_labels for sent in test]
+
+
+def model_size(model_dir):
+    return sum(getsize(join(model_dir, fname)) for fname in MODEL_FILES if exists(join(model_dir, fname)))
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="""Prune features with negligible weights from a trained model.""")
+    parser.add_argument('model', help="Directory of the trained model.")
+    parser.add_argument('output', help="Save the pruned model in this directory.")
+    parser.add_argument('--threshold', help="Drop features whose absolute weight is at most this value "
+                                            "for all labels.", type=float, default=0.0)
+    parser.add_argument('--top-k', help="Keep at most K features, those with the largest weight norm.", type=int)
+    parser.add_argument('--test', help="Report the accuracy of the original and the pruned model on this data.")
+
+    args = parser.parse_args()
+
+    n_feats, n_kept = prune_model(args.model, args.output, threshold=args.threshold, top_k=args.top_k)
+    logging.info("Kept {} of {} features ({:.1%}). Model size {:.1f} MB -> {:.1f} MB".format(
+        n_kept, n_feats, n_kept / max(n_feats, 1), model_size(args.model) / 1e6, model_size(args.output) / 1e6))
+
+    if args.test:
+        orig_accuracy, orig_pred = evaluate(args.model, args.test)
+        pruned_accuracy, pruned_pred = evaluate(args.output, args.test)
+        logging.info("Accuracy: {:.4f} (original) {:.4f} (pruned). Delta {:+.4f}. Identical predictions: {}".format(
+            orig_accuracy, pruned_accuracy, pruned_accuracy - orig_accuracy, orig_pred == pruned_pred))
+
+if __name__ == '__main__':
+    main()
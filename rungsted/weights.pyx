@@ -155,6 +155,55 @@ cdef class WeightVector:
     def copy(self):
         return WeightVector(self.dims, self.ada_grad, np.asarray(self.w).copy())
 
+    def grow(self, int n_labels, int n_feats):
+        """Lay out the vector for a feature map that has grown to `n_feats` features
+        in each of its `n_labels` sections. The new features start out as in a new vector."""
+        cdef int old_n_feats = self.n // n_labels
+        for name, fill in [('w', 0), ('acc', 0), ('base', 0), ('adagrad_squares', 1),
+                           ('last_update', 0), ('active', 1)]:
+            old = np.asarray(getattr(self, name)).reshape(n_labels, old_n_feats)
+            new = np.full((n_labels, n_feats), fill, dtype=old.dtype)
+            new[:, :old_n_feats] = old
+            setattr(self, name, new.ravel())
+
+        self.n = n_labels * n_feats
+        self.dims = (self.n,)
+
+    def get_state(self):
+        """Copy of the complete state of the vector, including what is needed to
+        continue averaging and scaling. Restore with `from_state`."""
+        return dict(dims=np.array(self.dims),
+                    ada_grad=self.ada_grad,
+                    w=np.array(self.w),
+                    acc=np.array(self.acc),
+                    base=np.array(self.base),
+                    adagrad_squares=np.array(self.adagrad_squares),
+                    last_update=np.array(self.last_update),
+                    active=np.array(self.active),
+                    n_updates=self.n_updates,
+                    mean=self.mean,
+                    m2=self.m2,
+                    scaling=self.scaling,
+                    decay=self.decay)
+
+    @classmethod
+    def from_state(cls, state):
+        cdef WeightVector w = cls(tuple(int(dim) for dim in state['dims']))
+        w.ada_grad = int(state['ada_grad'])
+        w.w = np.array(state['w'], dtype=np.float64)
+        w.acc = np.array(state['acc'], dtype=np.float64)
+        w.base = np.array(state['base'], dtype=np.float64)
+        w.adagrad_squares = np.array(state['adagrad_squares'], dtype=np.float64)
+        w.last_update = np.array(state['last_update'], dtype=np.int32)
+        w.active = np.array(state['active'], dtype=np.float64)
+        w.n_updates = int(state['n_updates'])
+        w.mean = float(state['mean'])
+        w.m2 = float(state['m2'])
+        w.scaling = float(state['scaling'])
+        w.decay = float(state['decay'])
+
+        return w
+
 cdef class ScaledWeightVector(WeightVector):
     cdef update(self, int feat_i, double val):
         # The parameter `val` is not scaled
@@ -77,6 +77,7 @@ setup(
     entry_points={
         'console_scripts': [
             'rungsted = rungsted.labeler:main',
+            'rungsted-prune = rungsted.prune:main',
         ]},
     long_description=read('README.md'),
     url="https://github.com/coastalcph/rungsted",
@@ -0,0 +1,212 @@
+import os
+import numpy as np
+from nose.tools import eq_, assert_raises
+
+from rungsted.checkpoint import Checkpointer, load_checkpoint, restore_random_state
+from rungsted.corruption import FastBinomialCorruption, get_random_state, set_random_state
+from rungsted.feat_map import CDictFeatMap
+from rungsted.input import read_vw_seq
+from rungsted.labeler import train_passes
+from rungsted.struct_perceptron import update_weights
+from rungsted.weights import WeightVector, ScaledWeightVector
+
+from helpers import BROWN_FILENAME, temp_dir, vw_filename
+
+
+def test_random_state():
+    feat_map = CDictFeatMap()
+    seqs, labels = read_vw_seq(vw_filename('small.vw'), feat_map)
+    feat_map.n_labels = len(labels)
+    transition = WeightVector((len(labels) + 2, len(labels) + 2))
+    emission = WeightVector(feat_map.n_feats())
+    corrupter = FastBinomialCorruption(0.5, feat_map, len(labels))
+
+    def drop_out():
+        corrupter.corrupt_sequence(seqs[0], emission, transition)
+        return np.array(emission.active), np.array(transition.active)
+
+    state = get_random_state()
+    first = drop_out()
+    second = drop_out()
+    assert not np.array_equal(first[1], second[1])
+
+    set_random_state(state)
+    for expected, actual in zip(first, drop_out()):
+        assert np.array_equal(expected, actual)
+
+
+def test_save_and_resume():
+    transition = ScaledWeightVector((4, 4), l2_decay=0.01)
+    emission = ScaledWeightVector(10, l2_decay=0.01)
+    transition.update2d(1, 2, 0.5)
+    transition.update_done()
+    emission.update2d(0, 3, -1.5)
+    emission.update_done()
+
+    feat_map = CDictFeatMap()
+    feat_map.feat2index_ = {b'^a': 0, b'^b': 1}
+    feat_map.n_labels = 5
+
+    with temp_dir() as tmp_dir:
+        checkpointer = Checkpointer(tmp_dir, keep=1)
+        checkpointer.save(transition, emission, feat_map, [b'A', b'B'], dict(epoch=2, sentence=7, n_updates=42))
+        expected_numpy = np.random.rand()
+        checkpointer.wait()
+
+        checkpoint = load_checkpoint(tmp_dir)
+
+    eq_(checkpoint['labels'], [b'A', b'B'])
+    eq_(checkpoint['feat_map'].feat2index_, feat_map.feat2index_)
+    eq_(checkpoint['progress']['epoch'], 2)
+    eq_(checkpoint['progress']['sentence'], 7)
+    eq_(checkpoint['progress']['n_updates'], 42)
+
+    restore_random_state(checkpoint['progress'])
+    eq_(np.random.rand(), expected_numpy)
+
+    for original in [transition, emission]:
+        restored = ScaledWeightVector.from_state(original.get_state())
+        eq_(restored.dims, original.dims)
+        eq_(restored.n_updates, original.n_updates)
+        eq_(restored.scaling, original.scaling)
+        eq_(restored.decay, original.decay)
+        assert np.array_equal(restored.w, original.w)
+        assert np.array_equal(restored.acc, original.acc)
+        assert np.array_equal(restored.last_update, original.last_update)
+
+    restored = ScaledWeightVector.from_state(checkpoint['emission'])
+    assert np.array_equal(restored.w, emission.w)
+    eq_(restored.scaling, emission.scaling)
+
+
+def small_state():
+    transition = WeightVector((3, 3))
+    emission = WeightVector(6)
+    feat_map = CDictFeatMap()
+    feat_map.feat2index_ = {b'^a': 0, b'^b': 1}
+    return transition, emission, feat_map
+
+
+def test_same_n_updates_keeps_latest():
+    transition, emission, feat_map = small_state()
+
+    with temp_dir() as tmp_dir:
+        checkpointer = Checkpointer(tmp_dir)
+        checkpointer.save(transition, emission, feat_map, [b'A'], dict(epoch=1, sentence=500, n_updates=500))
+        # End of the pass, with the same number of updates
+        checkpointer.save(transition, emission, feat_map, [b'A'], dict(epoch=2, sentence=0, n_updates=500))
+        checkpointer.wait()
+        eq_(load_checkpoint(tmp_dir)['progress']['sentence'], 500)
+
+        # A resumed run saving the checkpoint it started from
+        checkpointer = Checkpointer(tmp_dir)
+        checkpointer.save(transition, emission, feat_map, [b'A'], dict(epoch=2, sentence=0, n_updates=500))
+        checkpointer.wait()
+        eq_(sorted(os.listdir(tmp_dir)), ['checkpoint-500', 'latest'])
+        eq_(load_checkpoint(tmp_dir)['progress']['n_updates'], 500)
+
+
+def test_load_falls_back_to_complete_checkpoint():
+    transition, emission, feat_map = small_state()
+
+    with temp_dir() as tmp_dir:
+        checkpointer = Checkpointer(tmp_dir, keep=3)
+        for n_updates in [10, 20, 30]:
+            checkpointer.save(transition, emission, feat_map, [b'A'], dict(epoch=1, sentence=n_updates,
+                                                                            n_updates=n_updates))
+        checkpointer.wait()
+
+        # Dangling pointer
+        with open(os.path.join(tmp_dir, 'latest'), 'w') as out:
+            print('checkpoint-40', file=out)
+        eq_(load_checkpoint(tmp_dir)['progress']['n_updates'], 30)
+
+        # Incomplete newest checkpoint
+        os.remove(os.path.join(tmp_dir, 'checkpoint-30', 'progress.json'))
+        eq_(load_checkpoint(tmp_dir)['progress']['n_updates'], 20)
+
+
+def test_write_error_raised_by_wait():
+    transition, emission, feat_map = small_state()
+
+    with temp_dir() as tmp_dir:
+        checkpointer = Checkpointer(tmp_dir)
+        # A file where the checkpoint directory should go
+        open(os.path.join(tmp_dir, 'checkpoint-10.tmp'), 'w').close()
+        checkpointer.save(transition, emission, feat_map, [b'A'], dict(epoch=1, sentence=10, n_updates=10))
+        assert_raises(OSError, checkpointer.wait)
+        # The error is raised once
+        checkpointer.wait()
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(n_updates):
+    # Stands in for a run that is killed after `n_updates` more sentences
+    def weight_updater(*args):
+        if weight_updater.n_calls == n_updates:
+            raise Interrupted()
+        weight_updater.n_calls += 1
+        update_weights(*args)
+    weight_updater.n_calls = 0
+    return weight_updater
+
+
+def train_brown(random_state, checkpoint_dir=None, checkpoint_every=None, interrupt=None, resume=False):
+    # Trains on the first 40 sentences as the tagger does with --drop-out --l2-decay 0.001 --passes 3
+    feat_map, labels, progress = CDictFeatMap(), None, None
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_dir)
+        feat_map, labels, progress = checkpoint['feat_map'], checkpoint['labels'], checkpoint['progress']
+    else:
+        set_random_state(random_state)
+
+    train, labels = read_vw_seq(BROWN_FILENAME, feat_map, labels=labels)
+    train = train[:40]
+    feat_map.freeze()
+    feat_map.n_labels = len(labels)
+
+    if resume:
+        transition = ScaledWeightVector.from_state(checkpoint['transition'])
+        emission = ScaledWeightVector.from_state(checkpoint['emission'])
+    else:
+        transition = ScaledWeightVector((len(labels) + 2, len(labels) + 2), l2_decay=0.001)
+        emission = ScaledWeightVector(feat_map.n_feats(), l2_decay=0.001)
+
+    checkpointer = Checkpointer(checkpoint_dir) if checkpoint_dir else None
+    try:
+        train_passes(train, transition, emission, feat_map, labels, 3,
+                     weight_updater=interrupt_after(interrupt) if interrupt else update_weights,
+                     corrupter=FastBinomialCorruption(0.1, feat_map, len(labels)),
+                     checkpointer=checkpointer, checkpoint_every=checkpoint_every, progress=progress)
+    except Interrupted:
+        checkpointer.wait()
+        return None
+
+    return transition.get_state(), emission.get_state()
+
+
+def test_resume_gives_identical_weights():
+    random_state = get_random_state()
+    expected = train_brown(random_state)
+
+    # Interrupted runs as (checkpoint_every, updates before each interruption), and the checkpoint resumed from.
+    # With 40 sentences per pass:
+    scenarios = [(15, [25]),  # mid-pass, at pass 1 sentence 15
+                 (15, [50]),  # mid-pass after an end-of-pass checkpoint, at pass 2 sentence 5
+                 (20, [45]),  # periodic checkpoint on the pass boundary, at pass 1 sentence 40
+                 (15, [25, 30])]  # resume of a resume, at pass 2 sentence 5
+    for checkpoint_every, interrupts in scenarios:
+        with temp_dir() as tmp_dir:
+            eq_(train_brown(random_state, tmp_dir, checkpoint_every, interrupt=interrupts[0]), None)
+            for interrupt in interrupts[1:]:
+                eq_(train_brown(random_state, tmp_dir, checkpoint_every, interrupt=interrupt, resume=True), None)
+            resumed = train_brown(random_state, tmp_dir, checkpoint_every, resume=True)
+
+        for expected_state, resumed_state in zip(expected, resumed):
+            for name in ['w', 'acc', 'adagrad_squares', 'last_update', 'active']:
+                assert np.array_equal(expected_state[name], resumed_state[name]), (checkpoint_every, interrupts, name)
+            eq_(expected_state['n_updates'], resumed_state['n_updates'])
+            eq_(expected_state['scaling'], resumed_state['scaling'])
@@ -0,0 +1,58 @@
+import os
+from nose.tools import eq_
+
+from rungsted.feat_map import DictFeatMap, CDictFeatMap
+from rungsted.input import read_vw_seq
+
+from helpers import temp_dir, vw_filename
+
+
+def test_cdict_same_indices_as_dict():
+    dict_map = DictFeatMap()
+    dict_seqs, _ = read_vw_seq(vw_filename('small.vw'), dict_map)
+    cdict_map = CDictFeatMap()
+    cdict_seqs, _ = read_vw_seq(vw_filename('small.vw'), cdict_map)
+
+    eq_(cdict_map.feat2index_, dict_map.feat2index_)
+    eq_([seq.features for seq in cdict_seqs], [seq.features for seq in dict_seqs])
+
+    cdict_map.n_labels = 4
+    eq_(cdict_map.n_feats(), 4 * len(dict_map.feat2index_))
+
+
+def test_cdict_freeze():
+    feat_map = CDictFeatMap()
+    read_vw_seq(vw_filename('ns.vw'), feat_map)
+    n_feats = len(feat_map.feat2index_)
+
+    feat_map.freeze()
+    read_vw_seq(vw_filename('weighted.vw'), feat_map)
+    eq_(len(feat_map.feat2index_), n_feats)
+    assert b'1^e' not in feat_map.feat2index_
+
+
+def test_cdict_save_load():
+    feat_map = CDictFeatMap()
+    read_vw_seq(vw_filename('small.vw'), feat_map)
+    feat_map.n_labels = 7
+
+    with temp_dir() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'feature_map.npz')
+        feat_map.save(fname)
+        loaded = CDictFeatMap.load(fname)
+
+    eq_(loaded.n_labels, 7)
+    eq_(loaded.feat2index_, feat_map.feat2index_)
+
+    # Loaded map continues numbering after the existing features
+    seqs, _ = read_vw_seq(vw_filename('small.vw'), loaded)
+    eq_(loaded.feat2index_, feat_map.feat2index_)
+    read_vw_seq(vw_filename('weighted.vw'), loaded)
+    eq_(loaded.feat2index_[b'1^a'], len(feat_map.feat2index_))
+
+
+def test_cdict_set_feat2index():
+    feat_map = CDictFeatMap()
+    feat_map.feat2index_ = {b'b': 1, b'a': 0, b'c': 2}
+    eq_(feat_map.feat2index_, {b'a': 0, b'b': 1, b'c': 2})
+    eq_(feat_map.n_feats(), 0)
@@ -0,0 +1,21 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+BROWN_FILENAME = os.path.join(os.path.dirname(__file__), '..', 'data', 'brown.test.vw')
+
+
+def vw_filename(fname):
+    data_dir = os.path.join(os.path.dirname(__file__), 'data')
+    return os.path.join(data_dir, fname)
+
+
+@contextmanager
+def temp_dir():
+    """Temporary directory, removed with its contents afterwards."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        yield tmp_dir
+    finally:
+        shutil.rmtree(tmp_dir)
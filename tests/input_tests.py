@@ -1,13 +1,17 @@
+import bz2
+import gzip
+import lzma
 import os
+import shutil
+import subprocess
+import sys
+import unittest
 from nose.tools import eq_, nottest
 
 from rungsted.feat_map import DictFeatMap
-from rungsted.input import read_vw_seq
-
-def vw_filename(fname):
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    return os.path.join(data_dir, fname)
+from rungsted.input import read_vw_seq, read_conll_seq, ReadAhead, open_input
 
+from helpers import BROWN_FILENAME, temp_dir, vw_filename
 
 
 def test_weighted_features():
@@ -90,3 +94,128 @@ def test_ignore_ns():
     seqs, labels = read_vw_seq(vw_filename('ns.vw'), feat_map, ignore=['3'])
     assert not any(key.startswith(b'3xx') for key in feat_map.feat2index_.keys())
 
+
+def test_zstd_input():
+    try:
+        import zstandard
+    except ImportError:
+        raise unittest.SkipTest("zstandard is not installed")
+
+    plain_seqs, plain_labels = read_vw_seq(vw_filename('weighted.vw'), DictFeatMap())
+
+    with temp_dir() as tmp_dir:
+        compressed_fname = os.path.join(tmp_dir, 'weighted.vw.zst')
+        with open(vw_filename('weighted.vw'), 'rb') as in_file, open(compressed_fname, 'wb') as out:
+            out.write(zstandard.ZstdCompressor().compress(in_file.read()))
+
+        seqs, labels = read_vw_seq(compressed_fname, DictFeatMap())
+        eq_(labels, plain_labels)
+        eq_([seq.features for seq in seqs], [seq.features for seq in plain_seqs])
+
+
+
+def test_read_ahead_fills_blocks():
+    # Each read of a gzip file returns a single decompressed chunk of about 32 KB
+    block_size = 1 << 18
+
+    with temp_dir() as tmp_dir:
+        compressed_fname = os.path.join(tmp_dir, 'brown.test.vw.gz')
+        with open(BROWN_FILENAME, 'rb') as in_file, gzip.open(compressed_fname, 'wb') as out:
+            shutil.copyfileobj(in_file, out)
+
+        block_sizes = []
+        with ReadAhead(open_input(compressed_fname), block_size=block_size) as read_ahead:
+            for block in iter(read_ahead.blocks.get, []):
+                block_sizes.append(sum(len(line) for line in block))
+
+        eq_(sum(block_sizes), os.path.getsize(BROWN_FILENAME))
+        # Blocks end at a line break, and the last one holds the rest of the file
+        assert min(block_sizes[:-1]) > block_size - 1024, block_sizes
+
+
+READ_STDIN = """
+from rungsted.feat_map import DictFeatMap
+from rungsted.input import read_vw_seq
+seqs, labels = read_vw_seq('-', DictFeatMap())
+print(repr([seq.features for seq in seqs]))
+"""
+
+def run_python(code, **kwargs):
+    return subprocess.Popen([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)) or '.',
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+
+
+def test_stdin_input():
+    plain_seqs, _ = read_vw_seq(vw_filename('weighted.vw'), DictFeatMap())
+
+    with open(vw_filename('weighted.vw'), 'rb') as in_file:
+        child = run_python(READ_STDIN, stdin=in_file)
+        out, err = child.communicate(timeout=30)
+
+    eq_(child.returncode, 0, err)
+    eq_(out.decode('utf-8').strip(), repr([seq.features for seq in plain_seqs]))
+
+
+def test_stdin_error_on_stalled_pipe():
+    # The parse error must be raised without waiting for more input
+    child = run_python(READ_STDIN, stdin=subprocess.PIPE)
+    try:
+        child.stdin.write(b"A 'x| a\nmissing bar\n")
+        child.stdin.flush()
+        child.wait(timeout=10)
+        assert child.returncode != 0
+    finally:
+        child.stdin.close()
+        child.kill()
+        child.wait()
+
+
+def test_conll_matches_vw():
+    # small.vw is the output of conll_to_vw.py on small.conll with the honnibal13 feature set
+    vw_map = DictFeatMap()
+    vw_seqs, vw_labels = read_vw_seq(vw_filename('small.vw'), vw_map)
+    conll_map = DictFeatMap()
+    conll_seqs, conll_labels = read_conll_seq(vw_filename('small.conll'), conll_map, feature_set='honnibal13')
+
+    eq_(vw_labels, conll_labels)
+    eq_(len(vw_seqs), len(conll_seqs))
+
+    vw_index2feat = {idx: feat_name for feat_name, idx in vw_map.feat2index_.items()}
+    conll_index2feat = {idx: feat_name for feat_name, idx in conll_map.feat2index_.items()}
+
+    for vw_seq, conll_seq in zip(vw_seqs, conll_seqs):
+        eq_(vw_seq.ids, conll_seq.ids)
+        eq_(vw_seq.gold_labels, conll_seq.gold_labels)
+        eq_([vw_index2feat[index] for index, _ in vw_seq.features],
+            [conll_index2feat[index] for index, _ in conll_seq.features])
+
+
+def test_compressed_input():
+    plain_map = DictFeatMap()
+    plain_seqs, plain_labels = read_vw_seq(vw_filename('weighted.vw'), plain_map)
+
+    with temp_dir() as tmp_dir:
+        for compressed_open, ext in [(gzip.open, 'gz'), (bz2.open, 'bz2'), (lzma.open, 'xz')]:
+            compressed_fname = os.path.join(tmp_dir, 'weighted.vw.' + ext)
+            with open(vw_filename('weighted.vw'), 'rb') as in_file, compressed_open(compressed_fname, 'wb') as out:
+                shutil.copyfileobj(in_file, out)
+
+            feat_map = DictFeatMap()
+            seqs, labels = read_vw_seq(compressed_fname, feat_map)
+
+            eq_(labels, plain_labels)
+            eq_([seq.features for seq in seqs], [seq.features for seq in plain_seqs])
+            eq_(feat_map.feat2index_, plain_map.feat2index_)
+
+
+def test_conll_unicode_digits():
+    feat_map = DictFeatMap()
+    seqs, labels = read_conll_seq(vw_filename('digits.conll'), feat_map, feature_set='taskar12')
+    index2feat = {idx: feat_name for feat_name, idx in feat_map.feat2index_.items()}
+
+    word_feats = [index2feat[index] for index, _ in seqs[0].features if index2feat[index].startswith(b'^w=')]
+    eq_(word_feats, [b'^w=page', '^w=\u00b2'.encode('utf-8'), b'^w=!year', b'^w=!digits'])
+
+    # A superscript digit is not collapsed into a number class, but still counts as a digit
+    assert b'^suf2=\xc2\xb2' in feat_map.feat2index_
+    assert b'^hasdigit' in feat_map.feat2index_
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+from nose.tools import eq_
+
+from rungsted.decoding import Viterbi
+from rungsted.feat_map import CDictFeatMap
+from rungsted.input import read_vw_seq
+from rungsted.prune import prune_model, evaluate, load_feat_map
+from rungsted.struct_perceptron import update_weights
+from rungsted.weights import WeightVector
+
+from helpers import temp_dir, vw_filename
+
+
+def save_model(model_dir, zero_every=3):
+    feat_map = CDictFeatMap()
+    seqs, labels = read_vw_seq(vw_filename('small.vw'), feat_map)
+    feat_map.n_labels = len(labels)
+    n_feats = feat_map.n_feats() // len(labels)
+
+    rng = np.random.RandomState(1)
+    w = rng.normal(size=(len(labels), n_feats))
+    w[:, ::zero_every] = 0
+    transition = WeightVector((len(labels) + 2, len(labels) + 2), w=rng.normal(size=(len(labels) + 2) ** 2))
+    emission = WeightVector(feat_map.n_feats(), w=w.ravel())
+
+    os.makedirs(model_dir)
+    transition.save(os.path.join(model_dir, 'transition.npz'))
+    emission.save(os.path.join(model_dir, 'emission.npz'))
+    np.save(os.path.join(model_dir, 'labels'), labels)
+    feat_map.save(os.path.join(model_dir, 'feature_map.npz'))
+
+    return feat_map, w
+
+
+def test_prune_zero_features():
+    with temp_dir() as tmp_dir:
+        model_dir = os.path.join(tmp_dir, 'model')
+        pruned_dir = os.path.join(tmp_dir, 'pruned')
+        feat_map, w = save_model(model_dir)
+
+        n_feats, n_kept = prune_model(model_dir, pruned_dir)
+        eq_(n_feats, w.shape[1])
+        eq_(n_kept, n_feats - len(range(0, n_feats, 3)))
+
+        # Remaining features keep their order and weights
+        pruned_map = load_feat_map(pruned_dir)
+        names = sorted(feat_map.feat2index_, key=feat_map.feat2index_.get)
+        eq_(sorted(pruned_map.feat2index_, key=pruned_map.feat2index_.get),
+            [name for i, name in enumerate(names) if i % 3 != 0])
+        pruned_w = np.asarray(WeightVector.load(os.path.join(pruned_dir, 'emission.npz')).w)
+        assert np.array_equal(pruned_w.reshape(w.shape[0], n_kept), w[:, np.arange(n_feats) % 3 != 0])
+
+        # Tagging is unaffected
+        orig_accuracy, orig_pred = evaluate(model_dir, vw_filename('small.vw'))
+        pruned_accuracy, pruned_pred = evaluate(pruned_dir, vw_filename('small.vw'))
+        eq_(orig_pred, pruned_pred)
+        eq_(orig_accuracy, pruned_accuracy)
+
+
+def test_prune_top_k():
+    with temp_dir() as tmp_dir:
+        model_dir = os.path.join(tmp_dir, 'model')
+        pruned_dir = os.path.join(tmp_dir, 'pruned')
+        feat_map, w = save_model(model_dir)
+
+        n_feats, n_kept = prune_model(model_dir, pruned_dir, top_k=5)
+        eq_(n_kept, 5)
+
+        norms = np.linalg.norm(w, axis=0)
+        names = sorted(feat_map.feat2index_, key=feat_map.feat2index_.get)
+        expected = set(names[i] for i in np.argsort(-norms)[:5])
+        eq_(set(load_feat_map(pruned_dir).feat2index_), expected)
+
+
+def test_warm_start_from_pruned_model():
+    with temp_dir() as tmp_dir:
+        model_dir = os.path.join(tmp_dir, 'model')
+        pruned_dir = os.path.join(tmp_dir, 'pruned')
+        feat_map, w = save_model(model_dir)
+        prune_model(model_dir, pruned_dir)
+
+        # Reading the training data again adds the pruned features back to the map
+        labels = list(np.load(os.path.join(pruned_dir, 'labels.npy')))
+        transition = WeightVector.load(os.path.join(pruned_dir, 'transition.npz'))
+        emission = WeightVector.load(os.path.join(pruned_dir, 'emission.npz'))
+        pruned_map = load_feat_map(pruned_dir)
+        seqs, _ = read_vw_seq(vw_filename('small.vw'), pruned_map, labels=labels)
+        eq_(pruned_map.n_feats(), feat_map.n_feats())
+        assert pruned_map.n_feats() > emission.n
+
+        emission.grow(len(labels), pruned_map.n_feats() // len(labels))
+        eq_(emission.n, pruned_map.n_feats())
+
+        # Kept features have their weights for every label, and the re-added ones are zero
+        grown_w = np.asarray(emission.w).reshape(len(labels), -1)
+        for name, orig_i in feat_map.feat2index_.items():
+            assert np.array_equal(grown_w[:, pruned_map.feat2index_[name]], w[:, orig_i])
+
+        vit = Viterbi(len(labels), transition, emission, pruned_map)
+        for sent in seqs:
+            vit.decode(sent)
+            update_weights(sent, transition, emission, 0.1, len(labels), pruned_map)
+            transition.update_done()
+            emission.update_done()